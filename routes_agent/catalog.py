@@ -0,0 +1,493 @@
+# routes_agent/catalog.py
+"""离线景点目录：每个城市一份紧凑的磁盘快照，供 plan_trip / 工具优先查询。
+
+目录结构（每个城市一个子目录）：
+    <root>/<城市>/index.json      景点 ID、名称、坐标、常规营业时间等
+    <root>/<城市>/matrix.f32      float32 行优先数组 [2, N, N]：车程秒数 + 距离米数，NaN 表示未知
+    <root>/<城市>/places_cache.json  Places searchText 原始结果及获取时间（仅构建时使用）
+
+加载时只读一个小 JSON，矩阵用 mmap 映射，不会整体读入内存。
+构建是增量的：未过期的 Places 缓存和坐标未变、且已有车程的景点对会直接复用，
+超过 MAX_SNAPSHOT_AGE 的 Places 结果和其余缺失的景点对（包括上次 Routes 失败
+留下的 NaN）会重新查询。快照的“年龄”按最旧一条 Places 结果的获取时间计算。
+
+构建命令：
+    python -m routes_agent.catalog 台北 花莲
+"""
+import argparse
+import array
+import json
+import math
+import mmap
+import os
+import re
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+try:
+    from config_env import GOOGLE_MAPS_API_KEY
+    from tools import (
+        google_route_matrix, places_search_text, format_duration, rag_recommend_attractions,
+    )
+except ImportError:
+    from .config_env import GOOGLE_MAPS_API_KEY
+    from .tools import (
+        google_route_matrix, places_search_text, format_duration, rag_recommend_attractions,
+    )
+
+CATALOG_VERSION = 1
+INDEX_FILE = "index.json"
+MATRIX_FILE = "matrix.f32"
+PLACES_CACHE_FILE = "places_cache.json"
+MINUTES_PER_WEEK = 7 * 24 * 60
+# plan_trip 每个城市最多从目录取多少个景点（与 LLM 推荐的 2-3 个保持一致）
+RECOMMEND_LIMIT = 3
+# Places 结果超过这个时间即视为过期：构建时重新获取，查询营业信息时改为在线查询
+MAX_SNAPSHOT_AGE = 7 * 24 * 3600
+
+
+def _normalize(name: str) -> str:
+    return re.sub(r"\s+", "", name).lower()
+
+
+def _write_atomic(path: str, data: bytes):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def open_now_from_periods(periods: List[dict], utc_offset_minutes: Optional[int],
+                          now: Optional[datetime] = None) -> Optional[bool]:
+    """根据常规营业时段离线推算当前是否营业；信息不足时返回 None。"""
+    if not periods or utc_offset_minutes is None:
+        return None
+    now = now or datetime.now(timezone.utc)
+    local = now.astimezone(timezone(timedelta(minutes=utc_offset_minutes)))
+    # Places 的 day：0 = 周日；Python 的 weekday()：0 = 周一
+    day = (local.weekday() + 1) % 7
+    current = day * 1440 + local.hour * 60 + local.minute
+
+    for period in periods:
+        start = period.get("open")
+        if not start:
+            continue
+        end = period.get("close")
+        if not end:                 # 只有 open 没有 close：全天候开放
+            return True
+        o = start.get("day", 0) * 1440 + start.get("hour", 0) * 60 + start.get("minute", 0)
+        c = end.get("day", 0) * 1440 + end.get("hour", 0) * 60 + end.get("minute", 0)
+        if c <= o:                  # 跨周（例如周六开到周日凌晨）
+            c += MINUTES_PER_WEEK
+        if o <= current < c or o <= current + MINUTES_PER_WEEK < c:
+            return True
+    return False
+
+
+class CityCatalog:
+    """单个城市的只读快照；matrix 通过 mmap 按需读取。"""
+
+    def __init__(self, city: str, attractions: List[dict], matrix: Optional[memoryview],
+                 mode: str = "DRIVE", built_at: float = 0.0, fetched_at: float = 0.0,
+                 mm: Optional[mmap.mmap] = None):
+        self.city = city
+        self.attractions = attractions
+        self.mode = mode
+        self.built_at = built_at
+        # 最旧一条 Places 结果的获取时间；营业信息的新鲜度以它为准
+        self.fetched_at = fetched_at
+        self._matrix = matrix
+        self._mmap = mm
+        self._by_name: Dict[str, int] = {}
+        for i, a in enumerate(attractions):
+            for key in (a.get("name"), a.get("display_name")):
+                if key:
+                    self._by_name.setdefault(_normalize(key), i)
+
+    def __len__(self):
+        return len(self.attractions)
+
+    def close(self):
+        """释放 mmap；Windows 下映射中的文件不能被 os.replace 覆盖。"""
+        if self._matrix is not None:
+            self._matrix.release()
+            self._matrix = None
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def age_seconds(self) -> float:
+        return max(0.0, time.time() - self.fetched_at)
+
+    def is_stale(self, max_age: float = MAX_SNAPSHOT_AGE) -> bool:
+        return self.age_seconds() > max_age
+
+    def age_text(self) -> str:
+        hours = int(self.age_seconds() // 3600)
+        return f"{hours // 24}天前" if hours >= 24 else f"{hours}小时前"
+
+    @classmethod
+    def load(cls, city_dir: str) -> Optional["CityCatalog"]:
+        index_path = os.path.join(city_dir, INDEX_FILE)
+        if not os.path.exists(index_path):
+            return None
+        with open(index_path, encoding="utf-8") as f:
+            index = json.load(f)
+        if index.get("version") != CATALOG_VERSION:
+            return None
+
+        attractions = index.get("attractions", [])
+        matrix = mm = None
+        matrix_path = os.path.join(city_dir, MATRIX_FILE)
+        n = len(attractions)
+        if n and os.path.exists(matrix_path) and os.path.getsize(matrix_path) == 2 * n * n * 4:
+            with open(matrix_path, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            matrix = memoryview(mm).cast("f")
+        elif n and os.path.exists(matrix_path):
+            print(f"⚠️ 车程矩阵大小与景点数不符，已忽略: {matrix_path}")
+        # 没有 fetched_at 的旧快照无法判断营业信息新旧，按过期处理
+        return cls(index.get("city", os.path.basename(city_dir)), attractions, matrix,
+                   index.get("mode", "DRIVE"), index.get("built_at", 0.0),
+                   index.get("fetched_at", 0.0), mm)
+
+    # ---------- 查询 ----------
+    def index_of(self, name: str) -> Optional[int]:
+        return self._by_name.get(_normalize(name))
+
+    def find(self, name: str) -> Optional[dict]:
+        i = self.index_of(name)
+        return self.attractions[i] if i is not None else None
+
+    def _cell(self, layer: int, i: int, j: int) -> Optional[float]:
+        if self._matrix is None:
+            return None
+        n = len(self.attractions)
+        value = self._matrix[layer * n * n + i * n + j]
+        return None if math.isnan(value) else value
+
+    def duration(self, a: str, b: str) -> Optional[int]:
+        """两个景点间的预计算车程（秒）；任一方不在目录或未知时返回 None。"""
+        i, j = self.index_of(a), self.index_of(b)
+        if i is None or j is None:
+            return None
+        value = self._cell(0, i, j)
+        return int(value) if value is not None else None
+
+    def distance(self, a: str, b: str) -> Optional[int]:
+        i, j = self.index_of(a), self.index_of(b)
+        if i is None or j is None:
+            return None
+        value = self._cell(1, i, j)
+        return int(value) if value is not None else None
+
+    def open_now(self, name: str, now: Optional[datetime] = None) -> Optional[bool]:
+        a = self.find(name)
+        if a is None:
+            return None
+        return open_now_from_periods(a.get("periods", []), a.get("utc_offset_minutes"), now)
+
+    # ---------- 文本输出（与在线工具格式一致） ----------
+    def top_attractions(self, limit: int = RECOMMEND_LIMIT) -> List[dict]:
+        """按评分、评论数排序取前 limit 个景点。"""
+        ranked = sorted(self.attractions,
+                        key=lambda a: (a.get("rating") or 0, a.get("rating_count") or 0),
+                        reverse=True)
+        return ranked[:limit]
+
+    def recommendations_text(self, limit: int = RECOMMEND_LIMIT) -> str:
+        """与 rag_recommend_attractions 的 LLM 输出同格式，便于后续提取景点名称。
+
+        " - " 后的描述必须非空，否则提取时会退化成只取第一个词。
+        """
+        lines = [f"{self.city}："]
+        for i, a in enumerate(self.top_attractions(limit), 1):
+            desc = (a.get("description") or a.get("address")
+                    or a.get("display_name") or a["name"])
+            lines.append(f"{i}. {a['name']} - {desc}")
+        return "\n".join(lines)
+
+    def matrix_text(self, names: Optional[List[str]] = None) -> str:
+        """城市内景点间车程，格式同 google_route。"""
+        if names is None:
+            idx = list(range(len(self.attractions)))
+        else:
+            idx = [i for i in (self.index_of(n) for n in names) if i is not None]
+        lines = []
+        for i in idx:
+            for j in idx:
+                if i == j:
+                    continue
+                seconds = self._cell(0, i, j)
+                if seconds is None:
+                    continue
+                meters = self._cell(1, i, j) or 0
+                a, b = self.attractions[i]["name"], self.attractions[j]["name"]
+                lines.append(f"{a} → {b}: {meters / 1000:.1f} km, {format_duration(seconds)}")
+        return "\n".join(lines)
+
+
+class AttractionCatalog:
+    """按城市懒加载 CityCatalog；找不到快照的城市返回 None，由调用方走在线 API。"""
+
+    def __init__(self, root: str = "./travel_catalog"):
+        self.root = root
+        # city -> (index.json 的 mtime, 快照)；未命中不缓存，运行中新建的目录也能被发现
+        self._cities: Dict[str, Tuple[int, CityCatalog]] = {}
+
+    def city_dir(self, city: str) -> str:
+        return os.path.join(self.root, city)
+
+    def get(self, city: str) -> Optional[CityCatalog]:
+        try:
+            mtime = os.stat(os.path.join(self.city_dir(city), INDEX_FILE)).st_mtime_ns
+        except OSError:
+            self._cities.pop(city, None)
+            return None
+
+        cached = self._cities.get(city)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        if cached is not None:
+            cached[1].close()
+        try:
+            city_catalog = CityCatalog.load(self.city_dir(city))
+        except Exception as e:
+            print(f"加载景点目录失败 ({city}): {e}")
+            city_catalog = None
+        if city_catalog is None:
+            self._cities.pop(city, None)
+        else:
+            self._cities[city] = (mtime, city_catalog)
+        return city_catalog
+
+    def cities(self) -> List[str]:
+        try:
+            return sorted(d for d in os.listdir(self.root)
+                          if os.path.isdir(os.path.join(self.root, d)))
+        except OSError:
+            return []
+
+    def find(self, name: str) -> Optional[Tuple[CityCatalog, dict]]:
+        """在磁盘上所有城市的目录中查找景点（按需加载）。"""
+        for city in self.cities():
+            city_catalog = self.get(city)
+            if city_catalog is None:
+                continue
+            a = city_catalog.find(name)
+            if a is not None:
+                return city_catalog, a
+        return None
+
+    def invalidate(self, city: str):
+        self._cities.pop(city, None)
+
+
+# ---------- 离线构建 ----------
+def _parse_recommendations(text: str) -> List[Tuple[str, str]]:
+    """解析 "1. 景点名称 - 描述" 格式的推荐文本。"""
+    pairs = []
+    for line in text.split("\n"):
+        line = line.strip()
+        if not re.match(r"^\d+\.\s*", line):
+            continue
+        body = re.sub(r"^\d+\.\s*", "", line)
+        name, _, desc = body.partition(" - ")
+        name = name.strip().strip("*").strip()
+        if name:
+            pairs.append((name, desc.strip()))
+    return pairs
+
+
+def _unpack_cache_entry(entry: Optional[dict]) -> Tuple[Optional[dict], float]:
+    """places_cache.json 的条目为 {"fetched_at": ..., "place": {...}}；旧格式视为已过期。"""
+    if not entry:
+        return None, 0.0
+    if "place" in entry:
+        return entry["place"], entry.get("fetched_at", 0.0)
+    return entry, 0.0
+
+
+def _attraction_from_place(name: str, description: str, place: dict,
+                           fetched_at: float) -> dict:
+    hours = place.get("regularOpeningHours") or {}
+    location = place.get("location") or {}
+    return {
+        "id": place.get("id", ""),
+        "name": name,
+        "display_name": (place.get("displayName") or {}).get("text", name),
+        "description": description,
+        "address": place.get("formattedAddress", ""),
+        "lat": location.get("latitude"),
+        "lng": location.get("longitude"),
+        "rating": place.get("rating"),
+        "rating_count": place.get("userRatingCount", 0),
+        "business_status": place.get("businessStatus", ""),
+        "utc_offset_minutes": place.get("utcOffsetMinutes"),
+        "weekday_descriptions": hours.get("weekdayDescriptions", []),
+        "periods": hours.get("periods", []),
+        "fetched_at": fetched_at,
+    }
+
+
+def build_city_catalog(city: str, root: str = "./travel_catalog", rag=None,
+                       extra_attractions: Optional[List[str]] = None,
+                       refresh_places: bool = False, mode: str = "DRIVE",
+                       refresh_matrix: bool = False) -> CityCatalog:
+    """增量构建单个城市的目录快照并写入磁盘。
+
+    景点来源：已有快照 + 知识库推荐（传入 rag 时）+ extra_attractions。
+    Places 结果优先取 places_cache.json，超过 MAX_SNAPSHOT_AGE 的重新获取；
+    矩阵只为仍缺车程的景点对调用 Routes，refresh_matrix=True 时整张矩阵重新查询。
+    """
+    city_dir = os.path.join(root, city)
+    os.makedirs(city_dir, exist_ok=True)
+
+    previous = CityCatalog.load(city_dir)
+    cache_path = os.path.join(city_dir, PLACES_CACHE_FILE)
+    places_cache: Dict[str, dict] = {}
+    if os.path.exists(cache_path):
+        with open(cache_path, encoding="utf-8") as f:
+            places_cache = json.load(f)
+
+    # 1. 收集候选景点（保持顺序去重）
+    candidates: Dict[str, str] = {}
+    if previous is not None:
+        for a in previous.attractions:
+            candidates[a["name"]] = a.get("description", "")
+    if rag is not None:
+        for name, desc in _parse_recommendations(rag_recommend_attractions(rag, [city])):
+            if desc or name not in candidates:
+                candidates[name] = desc
+    for name in extra_attractions or []:
+        candidates.setdefault(name, "")
+
+    # 2. Places：缓存未命中或已过期才联网；联网失败时仍用旧缓存
+    now = time.time()
+    attractions: List[dict] = []
+    seen_ids = set()
+    for name, desc in candidates.items():
+        place, fetched_at = _unpack_cache_entry(places_cache.get(name))
+        expired = refresh_places or now - fetched_at > MAX_SNAPSHOT_AGE
+        if (place is None or expired) and GOOGLE_MAPS_API_KEY:
+            try:
+                status, fresh = places_search_text(name)
+                if fresh is not None:
+                    place, fetched_at = fresh, now
+                    places_cache[name] = {"fetched_at": now, "place": fresh}
+                else:
+                    print(f"⚠️ {name}: Places 无结果 (HTTP {status})")
+            except Exception as e:
+                print(f"⚠️ {name}: Places 查询出错 - {e}")
+        if place is None:
+            continue
+        a = _attraction_from_place(name, desc, place, fetched_at)
+        if a["lat"] is None or a["lng"] is None or a["id"] in seen_ids:
+            continue
+        seen_ids.add(a["id"])
+        attractions.append(a)
+    _write_atomic(cache_path, json.dumps(places_cache, ensure_ascii=False).encode("utf-8"))
+
+    # 3. 矩阵：复用旧快照里两端坐标都没变、且车程已知的景点对
+    n = len(attractions)
+    nan = float("nan")
+    matrix = array.array("f", [nan]) * (2 * n * n)
+    for i in range(n):
+        matrix[i * n + i] = 0.0
+        matrix[n * n + i * n + i] = 0.0
+
+    reusable: Dict[int, int] = {}
+    if previous is not None and previous.mode == mode and not refresh_matrix:
+        old_pos = {(a["id"], a["lat"], a["lng"]): k for k, a in enumerate(previous.attractions)}
+        for i, a in enumerate(attractions):
+            k = old_pos.get((a["id"], a["lat"], a["lng"]))
+            if k is not None:
+                reusable[i] = k
+    reused_pairs = 0
+    for i, k in reusable.items():
+        for j, m in reusable.items():
+            if i == j:
+                continue
+            seconds, meters = previous._cell(0, k, m), previous._cell(1, k, m)
+            if seconds is None or meters is None:
+                continue
+            matrix[i * n + j] = seconds
+            matrix[n * n + i * n + j] = meters
+            reused_pairs += 1
+    # 需要的车程已复制出来，释放旧矩阵的 mmap，之后才能覆盖 matrix.f32
+    if previous is not None:
+        previous.close()
+
+    # 仍为 NaN 的非对角线景点对按"缺失终点集合"分组，每组一次矩阵查询；
+    # 整行都缺的景点（新景点）合成一组，终点取全部景点
+    missing: Dict[Tuple[int, ...], List[int]] = {}
+    for i in range(n):
+        dests = tuple(j for j in range(n) if j != i and math.isnan(matrix[i * n + j]))
+        if n > 1 and len(dests) == n - 1:
+            dests = tuple(range(n))
+        if dests:
+            missing.setdefault(dests, []).append(i)
+    if missing:
+        coords = [(a["lat"], a["lng"]) for a in attractions]
+        requested = 0
+        for dests, origins in missing.items():
+            requested += sum(1 for i in origins for j in dests if i != j)
+            found = google_route_matrix([coords[i] for i in origins],
+                                        [coords[j] for j in dests], mode)
+            for (oi, di), (seconds, meters) in found.items():
+                i, j = origins[oi], dests[di]
+                if i == j:
+                    continue
+                matrix[i * n + j] = seconds
+                matrix[n * n + i * n + j] = meters
+        unresolved = sum(1 for i in range(n) for j in range(n)
+                         if i != j and math.isnan(matrix[i * n + j]))
+        print(f"🛣️ {city}: 查询 {requested} 个景点对，复用 {reused_pairs} 个")
+        if unresolved:
+            print(f"⚠️ {city}: 仍有 {unresolved} 个景点对没有车程，下次构建会重试")
+
+    # 4. 先写矩阵再写 index，index 存在即代表快照完整
+    _write_atomic(os.path.join(city_dir, MATRIX_FILE), matrix.tobytes())
+    index = {
+        "version": CATALOG_VERSION,
+        "city": city,
+        "mode": mode,
+        "built_at": time.time(),
+        "fetched_at": min((a["fetched_at"] for a in attractions), default=now),
+        "attractions": attractions,
+    }
+    _write_atomic(os.path.join(city_dir, INDEX_FILE),
+                  json.dumps(index, ensure_ascii=False, indent=1).encode("utf-8"))
+    print(f"✅ {city}: 目录包含 {n} 个景点")
+    return CityCatalog.load(city_dir)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="构建离线景点目录快照")
+    parser.add_argument("cities", nargs="+", help="要构建的城市")
+    parser.add_argument("--root", default="./travel_catalog", help="目录输出位置")
+    parser.add_argument("--attraction", action="append", default=[],
+                        help="额外加入的景点名称，可重复")
+    parser.add_argument("--no-rag", action="store_true", help="不从知识库发现新景点")
+    parser.add_argument("--refresh-places", action="store_true", help="忽略 Places 缓存重新查询")
+    parser.add_argument("--refresh-matrix", action="store_true", help="忽略已有车程重新查询整张矩阵")
+    parser.add_argument("--mode", default="DRIVE", help="Routes travelMode")
+    args = parser.parse_args(argv)
+
+    rag = None
+    if not args.no_rag:
+        try:
+            from rag_system import TravelRAGSystem
+        except ImportError:
+            from .rag_system import TravelRAGSystem
+        rag = TravelRAGSystem()
+
+    for city in args.cities:
+        build_city_catalog(city, args.root, rag, args.attraction,
+                           args.refresh_places, args.mode, args.refresh_matrix)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
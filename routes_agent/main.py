@@ -2,20 +2,21 @@
 """演示：调用 RAG 推荐、Google 路线并输出整体行程。"""
 import sys
 import os
-import requests  # 添加requests导入
 import json
 
 # 修复：支持不同的运行方式
 try:
     # 当作为模块运行时 (python -m routes_agent.main)
     from routes_agent.rag_system import TravelRAGSystem
-    from routes_agent.tools import rag_recommend_attractions, google_city_matrix
+    from routes_agent.tools import rag_recommend_attractions, google_city_matrix, places_search_text
     from routes_agent.config_env import OPENAI_API_KEY, GOOGLE_MAPS_API_KEY
+    from routes_agent.catalog import AttractionCatalog, open_now_from_periods
 except ImportError:
     # 当直接运行时 (python main.py)
     from rag_system import TravelRAGSystem
-    from tools import rag_recommend_attractions, google_city_matrix
+    from tools import rag_recommend_attractions, google_city_matrix, places_search_text
     from config_env import OPENAI_API_KEY, GOOGLE_MAPS_API_KEY
+    from catalog import AttractionCatalog, open_now_from_periods
 
 # 导入你原有的城市提取函数
 from langchain_openai import ChatOpenAI
@@ -50,45 +51,77 @@ def extract_attractions_from_recommendations(recommendations: str) -> str:
     unique_attractions = list(set(attractions))
     return ','.join(unique_attractions)
 
-def get_attraction_hours(attractions_str: str) -> str:
-    """获取景点的营业时间信息 - 使用你原版的实现"""
-    try:
-        from config_env import GOOGLE_MAPS_API_KEY
-    except ImportError:
-        from .config_env import GOOGLE_MAPS_API_KEY
-        
-    if not GOOGLE_MAPS_API_KEY:
-        return "Google Maps API密钥未配置"
-    
+def _format_attraction_hours(name, address, rating, rating_count, business_status,
+                             current_status, hours_text) -> str:
+    return f"""景点：{name}
+地址：{address}
+评分：{rating} ({rating_count} reviews)
+营业状态：{business_status}
+当前状态：{current_status}
+营业时间：
+{hours_text}"""
+
+def _catalog_attraction_hours(attraction: dict, age_text: str, outdated: bool = False) -> str:
+    """用离线目录里的常规营业时间生成信息，营业状态按时段在本地推算；
+    outdated=True 表示在线查询不可用，只能退回到可能已过期的快照"""
+    open_now = open_now_from_periods(attraction.get("periods", []),
+                                     attraction.get("utc_offset_minutes"))
+    if attraction.get("weekday_descriptions"):
+        hours_text = "\n".join(attraction["weekday_descriptions"])
+    else:
+        hours_text = "营业时间未知 (可能为24小时开放的户外景点)"
+    if open_now is None:
+        current_status = "状态未知"
+    else:
+        current_status = "营业中" if open_now else "未营业"
+    rating = attraction.get("rating")
+    return _format_attraction_hours(
+        attraction.get("display_name") or attraction["name"],
+        attraction.get("address") or "地址未知",
+        rating if rating is not None else "无评分",
+        attraction.get("rating_count", 0),
+        attraction.get("business_status") or "未知",
+        f"{current_status} (离线目录推算，营业信息获取于{age_text}"
+        + ("，在线查询不可用，可能已过期)" if outdated else ")"),
+        hours_text,
+    )
+
+def get_attraction_hours(attractions_str: str, catalog: AttractionCatalog = None,
+                         live: bool = False) -> str:
+    """获取景点的营业时间信息 - 先查离线目录；未命中、快照过期或 live=True 时调用 Places API"""
     try:
         attractions = [attr.strip() for attr in attractions_str.split(',')]
         results = []
         
         for attraction in attractions:
-            # 使用新版Places API搜索景点
-            search_url = "https://places.googleapis.com/v1/places:searchText"
-            
-            headers = {
-                "Content-Type": "application/json",
-                "X-Goog-Api-Key": GOOGLE_MAPS_API_KEY,
-                "X-Goog-FieldMask": "places.id,places.displayName,places.formattedAddress,places.rating,places.userRatingCount,places.businessStatus,places.currentOpeningHours,places.regularOpeningHours"
-            }
-            
-            request_body = {
-                "textQuery": attraction,
-                "languageCode": "en",
-                "regionCode": "TW",
-                "includedType": "tourist_attraction"
-            }
-            
-            search_response = requests.post(search_url, headers=headers, json=request_body, timeout=15)
+            hit = catalog.find(attraction) if catalog is not None else None
+            if hit is not None:
+                city_catalog, entry = hit
+                # 快照新鲜且不要求实时时直接使用目录
+                if not live and not city_catalog.is_stale():
+                    results.append(_catalog_attraction_hours(entry, city_catalog.age_text()))
+                    continue
+
+            if not GOOGLE_MAPS_API_KEY:
+                if hit is not None:
+                    results.append(_catalog_attraction_hours(entry, city_catalog.age_text(), True))
+                else:
+                    results.append(f"景点：{attraction}\nGoogle Maps API密钥未配置")
+                continue
+
+            # 使用新版Places API搜索景点；目录中有该景点时，在线失败就退回快照
+            try:
+                status_code, place = places_search_text(attraction)
+            except Exception:
+                if hit is None:
+                    raise
+                status_code, place = None, None
+            if place is None and hit is not None:
+                results.append(_catalog_attraction_hours(entry, city_catalog.age_text(), True))
+                continue
             
-            if search_response.status_code == 200:
-                search_data = search_response.json()
-                
-                if "places" in search_data and len(search_data["places"]) > 0:
-                    place = search_data["places"][0]
-                    
+            if status_code == 200:
+                if place is not None:
                     # 提取信息
                     name = place.get("displayName", {}).get("text", attraction)
                     address = place.get("formattedAddress", "地址未知")
@@ -110,19 +143,14 @@ def get_attraction_hours(attractions_str: str) -> str:
                         hours_text = "营业时间未知 (可能为24小时开放的户外景点)"
                         current_status = "状态未知"
                     
-                    result = f"""景点：{name}
-地址：{address}
-评分：{rating} ({rating_count} reviews)
-营业状态：{business_status}
-当前状态：{current_status}
-营业时间：
-{hours_text}"""
+                    result = _format_attraction_hours(name, address, rating, rating_count,
+                                                      business_status, current_status, hours_text)
                     
                     results.append(result)
                 else:
                     results.append(f"景点：{attraction}\n搜索返回空结果")
             else:
-                results.append(f"景点：{attraction}\nAPI调用失败 (HTTP {search_response.status_code})")
+                results.append(f"景点：{attraction}\nAPI调用失败 (HTTP {status_code})")
                 
         return "\n\n" + "="*50 + "\n\n".join(results)
         
@@ -199,8 +227,10 @@ def test_system():
         print(f"❌ RAG系统错误: {e}")
         return None
 
-def plan_trip(user_prompt: str, rag: TravelRAGSystem):
-    """完整的RAG增强智能旅行规划"""
+def plan_trip(user_prompt: str, rag: TravelRAGSystem, catalog: AttractionCatalog = None,
+              live_hours: bool = False):
+    """完整的RAG增强智能旅行规划；有离线景点目录的城市优先使用目录，
+    live_hours=True 时营业时间一律在线查询"""
     print(f"\n🎯 用户需求: {user_prompt}")
     print("-" * 50)
     
@@ -212,12 +242,18 @@ def plan_trip(user_prompt: str, rag: TravelRAGSystem):
     
     print(f"🏙️ 识别城市: {', '.join(cities)}")
     
+    if catalog is not None:
+        cached = [city for city in cities if catalog.get(city)]
+        if cached:
+            ages = [f"{city}({catalog.get(city).age_text()})" for city in cached]
+            print(f"🗂️ 使用离线景点目录: {', '.join(ages)}")
+    
     # 步骤2: RAG增强景点推荐
     print(f"\n📍 步骤1: RAG增强景点推荐")
     print("-" * 40)
     
     try:
-        recommendations = rag_recommend_attractions(rag, cities)
+        recommendations = rag_recommend_attractions(rag, cities, catalog)
         print("🤖 基于知识库的景点推荐:")
         print(recommendations)
         
@@ -232,10 +268,14 @@ def plan_trip(user_prompt: str, rag: TravelRAGSystem):
             print(f"📋 提取到的景点: {', '.join(attraction_list)}")
             
             # 步骤4: 调用Google Places API获取详细信息
-            print("\n⏰ 步骤3: 获取景点实时营业时间和详细信息")
+            if catalog is None or live_hours:
+                print("\n⏰ 步骤3: 获取景点实时营业时间和详细信息")
+            else:
+                print("\n⏰ 步骤3: 获取景点营业时间和详细信息（离线目录优先）")
             print("-" * 40)
             
-            attraction_details = get_attraction_hours(','.join(attraction_list))
+            attraction_details = get_attraction_hours(','.join(attraction_list), catalog,
+                                                      live=live_hours)
             print("📊 景点详细信息:")
             print(attraction_details)
             
@@ -261,6 +301,19 @@ def plan_trip(user_prompt: str, rag: TravelRAGSystem):
             city_routes = "单个城市，无需城市间路线规划"
             print("\n🛣️ 单个城市，无需城市间路线规划")
         
+        # 城市内景点间车程只来自离线目录的预计算矩阵
+        intra_routes = []
+        for city in cities:
+            city_catalog = catalog.get(city) if catalog is not None else None
+            if city_catalog is not None:
+                text = city_catalog.matrix_text(attraction_list)
+                if text:
+                    intra_routes.append(f"{city}：\n{text}")
+        intra_city_routes = "\n\n".join(intra_routes) if intra_routes else "暂无"
+        if intra_routes:
+            print("\n🚗 城市内景点间车程（离线目录）:")
+            print(intra_city_routes)
+        
         # 步骤6: 综合生成完整旅行规划
         print("\n📋 步骤5: 综合旅行规划")
         print("-" * 40)
@@ -293,6 +346,9 @@ RAG景点推荐：
 城市间路线：
 {city_routes}
 
+城市内景点间车程：
+{intra_city_routes}
+
 请制定一个详细的旅行计划，包括：
 1. 推荐的游览顺序
 2. 每个景点的最佳游览时间
@@ -333,6 +389,8 @@ def main():
         print("❌ 系统初始化失败")
         return
     
+    catalog = AttractionCatalog()
+    
     # 直接进入交互模式，跳过演示案例
     print("\n💬 交互模式 (输入 'quit' 退出):")
     
@@ -342,11 +400,11 @@ def main():
             if user_input.lower() in ['quit', 'exit', '退出']:
                 break
             if user_input:
-                plan_trip(user_input, rag)
+                plan_trip(user_input, rag, catalog)
         except KeyboardInterrupt:
             break
     
     print("👋 再见！")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
\ No newline at end of file
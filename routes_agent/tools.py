@@ -1,7 +1,7 @@
 # routes_agent/tools.py (修复导入)
 """把所有工具函数集中放在这里，方便在别处复用。"""
 import requests, itertools, json
-from typing import List
+from typing import Dict, List, Optional, Tuple
 from langchain_openai import ChatOpenAI
 from langchain.schema import HumanMessage
 
@@ -13,6 +13,16 @@ except ImportError:
     from .config_env import GOOGLE_MAPS_API_KEY, OPENAI_API_KEY, OPENAI_API_URL
     from .rag_system import TravelRAGSystem
 
+# Routes API 单次 computeRouteMatrix 的元素上限（非 TRAFFIC_AWARE_OPTIMAL）
+ROUTE_MATRIX_MAX_ELEMENTS = 625
+ROUTE_MATRIX_MAX_ELEMENTS_TRANSIT = 100
+
+PLACES_FIELD_MASK = (
+    "places.id,places.displayName,places.formattedAddress,places.rating,"
+    "places.userRatingCount,places.businessStatus,places.currentOpeningHours,"
+    "places.regularOpeningHours,places.location,places.utcOffsetMinutes"
+)
+
 # ---------- Google Maps ----------
 def google_route(origin: str, dest: str, mode: str = "DRIVE") -> str:
     if not GOOGLE_MAPS_API_KEY:
@@ -43,31 +53,125 @@ def google_route(origin: str, dest: str, mode: str = "DRIVE") -> str:
             
         route = data["routes"][0]
 
-        # --------- 兼容两种 duration 结构 ---------
-        dur = route.get("duration", 0)
-        if isinstance(dur, dict):                  # {"seconds": 5321}
-            seconds = int(dur.get("seconds", 0))
-        elif isinstance(dur, str) and dur.endswith("s"):   # "5321s"
-            seconds = int(dur[:-1])
-        else:
-            seconds = 0
-        hours, minutes = divmod(seconds // 60, 60)
-        dur_txt = f"{hours}h{minutes}m" if hours else f"{minutes}m"
-        # ----------------------------------------
-
+        seconds = parse_duration_seconds(route.get("duration", 0))
         km = route.get("distanceMeters", 0) / 1000
-        return f"{origin} → {dest}: {km:.1f} km, {dur_txt}"
+        return f"{origin} → {dest}: {km:.1f} km, {format_duration(seconds)}"
     except Exception as e:
         return f"{origin} → {dest}: 查询出错 - {str(e)}"
 
 
+def parse_duration_seconds(dur) -> int:
+    """兼容两种 duration 结构：{"seconds": 5321} 或 "5321s" """
+    if isinstance(dur, dict):
+        return int(dur.get("seconds", 0))
+    if isinstance(dur, str) and dur.endswith("s"):
+        return int(dur[:-1])
+    return 0
+
+
+def format_duration(seconds: int) -> str:
+    hours, minutes = divmod(int(seconds) // 60, 60)
+    return f"{hours}h{minutes}m" if hours else f"{minutes}m"
+
+
+def google_route_matrix(origins: List[Tuple[float, float]],
+                        dests: List[Tuple[float, float]],
+                        mode: str = "DRIVE") -> Dict[Tuple[int, int], Tuple[int, int]]:
+    """批量查询坐标间路线，返回 {(origin_idx, dest_idx): (seconds, meters)}。
+
+    查不到的组合不会出现在结果里；单次请求元素数超过上限时按行、列分批，
+    失败的批次会打印出来并跳过。
+    """
+    if not GOOGLE_MAPS_API_KEY or not origins or not dests:
+        return {}
+
+    url = "https://routes.googleapis.com/distanceMatrix/v2:computeRouteMatrix"
+    headers = {
+        "Content-Type": "application/json",
+        "X-Goog-Api-Key": GOOGLE_MAPS_API_KEY,
+        "X-Goog-FieldMask": "originIndex,destinationIndex,duration,distanceMeters,condition",
+    }
+
+    def waypoint(lat, lng):
+        return {"waypoint": {"location": {"latLng": {"latitude": lat, "longitude": lng}}}}
+
+    limit = (ROUTE_MATRIX_MAX_ELEMENTS_TRANSIT if mode.upper() == "TRANSIT"
+             else ROUTE_MATRIX_MAX_ELEMENTS)
+    cols_per_call = min(len(dests), limit)
+    rows_per_call = max(1, limit // cols_per_call)
+
+    result = {}
+    for row in range(0, len(origins), rows_per_call):
+        row_batch = origins[row:row + rows_per_call]
+        for col in range(0, len(dests), cols_per_call):
+            col_batch = dests[col:col + cols_per_call]
+            body = {
+                "origins": [waypoint(*o) for o in row_batch],
+                "destinations": [waypoint(*d) for d in col_batch],
+                "travelMode": mode,
+                "units": "METRIC",
+            }
+            batch_desc = f"起点 {row}-{row + len(row_batch) - 1} × 终点 {col}-{col + len(col_batch) - 1}"
+            try:
+                r = requests.post(url, headers=headers, json=body, timeout=30)
+                if not r.ok:
+                    print(f"⚠️ 路线矩阵查询失败({r.status_code}): {batch_desc}")
+                    continue
+                elements = r.json()
+            except Exception as e:
+                print(f"⚠️ 路线矩阵查询出错: {batch_desc} - {str(e)}")
+                continue
+            for el in elements:
+                if el.get("condition") != "ROUTE_EXISTS":
+                    continue
+                key = (row + el.get("originIndex", 0), col + el.get("destinationIndex", 0))
+                result[key] = (parse_duration_seconds(el.get("duration", 0)),
+                               int(el.get("distanceMeters", 0)))
+    return result
+
+
 def google_city_matrix(cities: List[str], mode="DRIVE") -> str:
     return "\n".join(
         google_route(a, b, mode) for a, b in itertools.permutations(cities, 2)
     )
 
+# ---------- Google Places ----------
+def places_search_text(query: str) -> Tuple[int, Optional[dict]]:
+    """用新版 Places API 搜索景点，返回 (HTTP 状态码, 第一个结果或 None)。"""
+    url = "https://places.googleapis.com/v1/places:searchText"
+    headers = {
+        "Content-Type": "application/json",
+        "X-Goog-Api-Key": GOOGLE_MAPS_API_KEY,
+        "X-Goog-FieldMask": PLACES_FIELD_MASK,
+    }
+    body = {
+        "textQuery": query,
+        "languageCode": "en",
+        "regionCode": "TW",
+        "includedType": "tourist_attraction",
+    }
+    r = requests.post(url, headers=headers, json=body, timeout=15)
+    if r.status_code != 200:
+        return r.status_code, None
+    places = r.json().get("places") or []
+    return r.status_code, (places[0] if places else None)
+
 # ---------- RAG 景点推荐工具 ----------
-def rag_recommend_attractions(rag: TravelRAGSystem, cities: List[str]) -> str:
+def rag_recommend_attractions(rag: TravelRAGSystem, cities: List[str], catalog=None) -> str:
+    """catalog 为 AttractionCatalog 时，已有离线目录的城市直接取目录，其余城市再问 LLM。"""
+    cached_sections = []
+    if catalog is not None:
+        remaining = []
+        for city in cities:
+            city_catalog = catalog.get(city)
+            if city_catalog is not None and len(city_catalog):
+                cached_sections.append(city_catalog.recommendations_text())
+            else:
+                remaining.append(city)
+        if not remaining:
+            return "\n\n".join(cached_sections)
+        cities = remaining
+
     # 修复：正确聚合上下文
     context_chunks = []
     for city in cities:
@@ -102,8 +206,10 @@ def rag_recommend_attractions(rag: TravelRAGSystem, cities: List[str]) -> str:
 - 如果知识库没有信息，基于常识推荐"""
 
         response = llm.invoke([HumanMessage(content=prompt)])
-        return response.content
+        return "\n\n".join(cached_sections + [response.content])
     except Exception as e:
+        if cached_sections:
+            return "\n\n".join(cached_sections + [f"推荐失败：{str(e)}"])
         return f"推荐失败：{str(e)}"
 
 # ---------- 辅助函数 ----------
@@ -114,4 +220,4 @@ def extract_cities_from_text(text: str) -> List[str]:
     cities = re.findall(r'[\u4e00-\u9fff]{2,4}', text)
     # 过滤掉常见非城市词汇
     filtered = [c for c in cities if c not in ['我想', '出发', '旅行', '景点', '推荐', '规划']]
-    return filtered[:5]  # 最多5个城市
\ No newline at end of file
+    return filtered[:5]  # 最多5个城市
\ No newline at end of file
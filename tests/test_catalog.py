@@ -0,0 +1,303 @@
+"""routes_agent.catalog 的离线测试：Places / Routes 均用假函数替换，不联网。"""
+import json
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytest.importorskip("requests")
+pytest.importorskip("dotenv")
+pytest.importorskip("langchain_openai")
+pytest.importorskip("chromadb")
+
+from routes_agent import catalog, main, tools
+
+
+# ---------- open_now_from_periods ----------
+TAIPEI = 480  # UTC+8
+
+
+def _utc(day, hour, minute=0):
+    """台北时间 2026-10-17（周六）+ day 天的 hour:minute。"""
+    return datetime(2026, 10, 17 + day, hour, minute,
+                    tzinfo=timezone(timedelta(minutes=TAIPEI)))
+
+
+SAT_NIGHT = [{"open": {"day": 6, "hour": 22, "minute": 0},
+              "close": {"day": 0, "hour": 2, "minute": 0}}]
+
+
+@pytest.mark.parametrize("day, hour, expected", [
+    (0, 23, True),    # 周六 23:00
+    (1, 1, True),     # 周日 01:00，跨周
+    (1, 3, False),    # 周日 03:00
+    (0, 21, False),   # 周六 21:00
+])
+def test_open_now_week_wrap(day, hour, expected):
+    assert catalog.open_now_from_periods(SAT_NIGHT, TAIPEI, _utc(day, hour)) is expected
+
+
+def test_open_now_24h_without_close():
+    periods = [{"open": {"day": 0, "hour": 0, "minute": 0}}]
+    assert catalog.open_now_from_periods(periods, TAIPEI, _utc(2, 4)) is True
+
+
+def test_open_now_unknown_without_periods():
+    assert catalog.open_now_from_periods([], TAIPEI) is None
+    assert catalog.open_now_from_periods(SAT_NIGHT, None) is None
+
+
+# ---------- build / rebuild ----------
+def _fake_place(name):
+    i = ord(name[0])
+    return {
+        "id": f"place-{name}",
+        "displayName": {"text": name.upper()},
+        "location": {"latitude": 25.0 + i / 1000, "longitude": 121.5},
+        "utcOffsetMinutes": TAIPEI,
+        "rating": 4.0 + (i % 10) / 10,
+        "userRatingCount": i,
+        "regularOpeningHours": {"weekdayDescriptions": ["Monday: 9:00 AM – 5:00 PM"],
+                                "periods": []},
+    }
+
+
+class FakePlaces:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, query):
+        self.calls.append(query)
+        return 200, _fake_place(query)
+
+
+class FakeRoutes:
+    def __init__(self):
+        self.calls = []
+        self.ok = True
+
+    def __call__(self, origins, dests, mode="DRIVE"):
+        self.calls.append((len(origins), len(dests)))
+        if not self.ok:
+            return {}
+        return {(i, j): (600, 1000) for i in range(len(origins)) for j in range(len(dests))}
+
+
+@pytest.fixture
+def places(monkeypatch):
+    fake = FakePlaces()
+    monkeypatch.setattr(catalog, "GOOGLE_MAPS_API_KEY", "test-key")
+    monkeypatch.setattr(catalog, "places_search_text", fake)
+    return fake
+
+
+@pytest.fixture
+def routes(monkeypatch, places):
+    fake = FakeRoutes()
+    monkeypatch.setattr(catalog, "google_route_matrix", fake)
+    return fake
+
+
+def _backdate(path, key, days=90):
+    """把 json 文件里的 fetched_at 往前拨 days 天（key 为 None 时改每个条目）。"""
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    past = time.time() - days * 24 * 3600
+    if key is None:
+        for entry in data.values():
+            entry["fetched_at"] = past
+    else:
+        data[key] = past
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+
+
+def test_build_and_incremental_rebuild(tmp_path, routes):
+    root = str(tmp_path)
+    built = catalog.build_city_catalog("台北", root, extra_attractions=["a", "b", "c"])
+    assert len(built) == 3
+    assert built.duration("a", "b") == 600
+    assert built.distance("a", "c") == 1000
+    assert built.duration("a", "a") == 0
+    assert routes.calls == [(3, 3)]
+
+    # 全部已知时不再调用 Routes
+    routes.calls.clear()
+    catalog.build_city_catalog("台北", root)
+    assert routes.calls == []
+
+    # 新增景点只查询与它相关的景点对
+    rebuilt = catalog.build_city_catalog("台北", root, extra_attractions=["d"])
+    assert len(rebuilt) == 4
+    assert sorted(routes.calls) == [(1, 4), (3, 1)]
+    assert rebuilt.duration("d", "a") == 600
+    assert rebuilt.duration("a", "b") == 600
+
+
+def test_rebuild_retries_failed_routes(tmp_path, routes):
+    root = str(tmp_path)
+    routes.ok = False
+    built = catalog.build_city_catalog("台北", root, extra_attractions=["a", "b"])
+    assert built.duration("a", "b") is None
+
+    routes.ok = True
+    routes.calls.clear()
+    rebuilt = catalog.build_city_catalog("台北", root)
+    assert routes.calls
+    assert rebuilt.duration("a", "b") == 600
+
+
+def test_refresh_matrix_requeries_everything(tmp_path, routes):
+    root = str(tmp_path)
+    catalog.build_city_catalog("台北", root, extra_attractions=["a", "b"])
+    routes.calls.clear()
+    catalog.build_city_catalog("台北", root, refresh_matrix=True)
+    assert routes.calls == [(2, 2)]
+
+
+def test_load_ignores_wrong_size_matrix(tmp_path, routes):
+    root = str(tmp_path)
+    catalog.build_city_catalog("台北", root, extra_attractions=["a", "b"])
+    with open(os.path.join(root, "台北", catalog.MATRIX_FILE), "wb") as f:
+        f.write(b"\0" * 12)
+
+    loaded = catalog.CityCatalog.load(os.path.join(root, "台北"))
+    assert len(loaded) == 2
+    assert loaded.duration("a", "b") is None
+
+    # 矩阵损坏后重建会重新查询
+    routes.calls.clear()
+    rebuilt = catalog.build_city_catalog("台北", root)
+    assert routes.calls
+    assert rebuilt.duration("a", "b") == 600
+
+
+def test_recommendations_are_capped_by_rating(tmp_path, routes):
+    root = str(tmp_path)
+    built = catalog.build_city_catalog("台北", root, extra_attractions=list("abcdefg"))
+    top = built.top_attractions()
+    assert len(top) == catalog.RECOMMEND_LIMIT
+    assert [a["name"] for a in top] == ["c", "b", "a"]
+    assert built.recommendations_text().count("\n") == catalog.RECOMMEND_LIMIT
+
+
+def test_catalog_picks_up_rebuilds(tmp_path, routes):
+    root = str(tmp_path)
+    cat = catalog.AttractionCatalog(root)
+    assert cat.get("台北") is None
+
+    catalog.build_city_catalog("台北", root, extra_attractions=["a"])
+    assert len(cat.get("台北")) == 1
+
+    catalog.build_city_catalog("台北", root, extra_attractions=["b"])
+    index_path = os.path.join(root, "台北", catalog.INDEX_FILE)
+    stat = os.stat(index_path)
+    os.utime(index_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    assert len(cat.get("台北")) == 2
+    assert cat.find("B") is not None
+
+
+def test_rebuild_refetches_expired_places(tmp_path, routes, places, monkeypatch):
+    root = str(tmp_path)
+    catalog.build_city_catalog("台北", root, extra_attractions=["a", "b"])
+    assert places.calls == ["a", "b"]
+
+    # 未过期的缓存不联网
+    places.calls.clear()
+    assert not catalog.build_city_catalog("台北", root).is_stale()
+    assert places.calls == []
+
+    # 过期的缓存重新获取，快照随之变新
+    _backdate(os.path.join(root, "台北", catalog.PLACES_CACHE_FILE), None)
+    rebuilt = catalog.build_city_catalog("台北", root)
+    assert sorted(places.calls) == ["a", "b"]
+    assert not rebuilt.is_stale()
+
+    # 无法联网时保留旧缓存，但快照按旧的获取时间算作过期
+    _backdate(os.path.join(root, "台北", catalog.PLACES_CACHE_FILE), None)
+    monkeypatch.setattr(catalog, "GOOGLE_MAPS_API_KEY", None)
+    rebuilt = catalog.build_city_catalog("台北", root)
+    assert len(rebuilt) == 2
+    assert rebuilt.is_stale()
+
+
+# ---------- 与 tools / main 的集成 ----------
+NAMES = ["Taipei 101", "Longshan Temple"]
+
+
+def test_recommendations_round_trip_to_catalog(tmp_path, routes):
+    root = str(tmp_path)
+    catalog.build_city_catalog("台北", root, extra_attractions=NAMES)
+    cat = catalog.AttractionCatalog(root)
+
+    # 目录命中的城市不走 LLM，rag 不会被用到
+    text = tools.rag_recommend_attractions(None, ["台北"], cat)
+    names = main.extract_attractions_from_recommendations(text).split(",")
+    assert sorted(names) == sorted(NAMES)
+    assert all(cat.find(name) is not None for name in names)
+    assert cat.get("台北").matrix_text(names).count("\n") == 1
+
+
+def _hours_catalog(root):
+    catalog.build_city_catalog("台北", root, extra_attractions=NAMES)
+    return catalog.AttractionCatalog(root)
+
+
+def test_attraction_hours_fresh_catalog_stays_offline(tmp_path, routes, monkeypatch):
+    cat = _hours_catalog(str(tmp_path))
+    live = FakePlaces()
+    monkeypatch.setattr(main, "GOOGLE_MAPS_API_KEY", "test-key")
+    monkeypatch.setattr(main, "places_search_text", live)
+
+    text = main.get_attraction_hours(",".join(NAMES), cat)
+    assert live.calls == []
+    assert text.count("离线目录推算") == 2
+
+    # live=True 时强制在线
+    text = main.get_attraction_hours(",".join(NAMES), cat, live=True)
+    assert sorted(live.calls) == sorted(NAMES)
+    assert "离线目录推算" not in text
+
+
+def test_attraction_hours_stale_catalog_goes_live(tmp_path, routes, monkeypatch):
+    root = str(tmp_path)
+    cat = _hours_catalog(root)
+    _backdate(os.path.join(root, "台北", catalog.INDEX_FILE), "fetched_at")
+    assert cat.get("台北").is_stale()
+
+    live = FakePlaces()
+    monkeypatch.setattr(main, "GOOGLE_MAPS_API_KEY", "test-key")
+    monkeypatch.setattr(main, "places_search_text", live)
+    text = main.get_attraction_hours(",".join(NAMES), cat)
+    assert sorted(live.calls) == sorted(NAMES)
+    assert "离线目录推算" not in text
+
+    # 在线失败时退回快照并标明可能过期
+    monkeypatch.setattr(main, "places_search_text", lambda q: (500, None))
+    text = main.get_attraction_hours(",".join(NAMES), cat)
+    assert text.count("可能已过期") == 2
+    assert "API调用失败" not in text
+
+
+def test_plan_trip_uses_catalog_routes(tmp_path, routes, monkeypatch):
+    cat = _hours_catalog(str(tmp_path))
+    prompts = []
+
+    class FakeLLM:
+        def __init__(self, **kwargs):
+            pass
+
+        def invoke(self, messages):
+            prompts.append(messages[0].content)
+            return type("Reply", (), {"content": "ok"})()
+
+    monkeypatch.setattr(main, "extract_cities_from_prompt", lambda prompt: ["台北"])
+    monkeypatch.setattr(main, "ChatOpenAI", FakeLLM)
+    main.plan_trip("台北一日游", rag=None, catalog=cat)
+
+    assert len(prompts) == 1
+    assert "Taipei 101 → Longshan Temple" in prompts[0]
+    assert "Longshan Temple → Taipei 101" in prompts[0]